@@ -0,0 +1,76 @@
+import random
+import threading
+import time
+from PIL import Image, ImageDraw
+
+from index import BRUSH_COLORS, describe_regions, extract_brush_colors, generate_prompt
+
+# Run with `python bench_drawing_analysis.py` to time the drawing analysis stage
+# on the app's own canvas size and on inputs a client could send at worst.
+ROUNDS = 20
+BUSY_THREADS = 3
+
+
+def typical_canvas():
+    # A few thick strokes on the 500x330 canvas the page uses
+    image = Image.new('RGBA', (500, 330), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((40, 20, 220, 120), fill='#646765')
+    draw.line((60, 130, 80, 250), fill='#0057e7', width=10)
+    draw.line((120, 130, 140, 260), fill='#0057e7', width=10)
+    draw.ellipse((360, 200, 460, 300), fill='#faab09')
+    return image
+
+
+def noisy_canvas(width, height):
+    # Every pixel a random brush color: the most regions the labeling can meet
+    colors = [tuple(int(hex_color[i:i + 2], 16) for i in (1, 3, 5)) + (255,) for hex_color in BRUSH_COLORS]
+    image = Image.new('RGBA', (width, height))
+    image.putdata([random.choice(colors) for _ in range(width * height)])
+    return image
+
+
+def busy_loop(stop):
+    # Stands in for other requests and background threads competing for the GIL
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def bench_under_load(name, image):
+    stop = threading.Event()
+    threads = [threading.Thread(target=busy_loop, args=(stop,), daemon=True) for _ in range(BUSY_THREADS)]
+    for thread in threads:
+        thread.start()
+    try:
+        return bench(name, image)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+def bench(name, image):
+    colors_ms, regions_ms, fallbacks = [], [], 0
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        colors = extract_brush_colors(image)
+        colors_ms.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        regions = describe_regions(image)
+        regions_ms.append((time.perf_counter() - start) * 1000)
+        fallbacks += regions is None
+    colors_ms.sort()
+    regions_ms.sort()
+    print(f"{name:<28} colors median {colors_ms[ROUNDS // 2]:6.2f} ms  "
+          f"regions median {regions_ms[ROUNDS // 2]:6.2f} ms  max {regions_ms[-1]:6.2f} ms  "
+          f"fallbacks {fallbacks}/{ROUNDS}")
+    return colors, regions
+
+
+if __name__ == '__main__':
+    colors, regions = bench('typical 500x330', typical_canvas())
+    bench('noise 500x330', noisy_canvas(500, 330))
+    bench('noise 2000x2000', noisy_canvas(2000, 2000))
+    bench_under_load(f"typical + {BUSY_THREADS} busy threads", typical_canvas())
+    bench_under_load(f"noise 500x330 + {BUSY_THREADS} busy", noisy_canvas(500, 330))
+    print(generate_prompt('a gloomy cloud over me', colors, regions))
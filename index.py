@@ -1,10 +1,25 @@
-from flask import Flask, request, jsonify, make_response, render_template_string, session
+from flask import Flask, request, jsonify, make_response, render_template_string, session, g, Response, redirect
 import requests
 import base64
 import openai
-from io import BytesIO
+from io import BytesIO, StringIO
 from PIL import Image
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import csv
+import hashlib
+import hmac
+import itertools
+import json
 import os
+import math
+import queue
+import re
+import sqlite3
+import uuid
+import sys
+import threading
+import time
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('OPENAI_API_KEY')
@@ -23,6 +38,447 @@ BRUSH_COLORS = {
     '#000000': 'black'
 }
 
+# Teacher/admin routes (session archive, question approval) expect this token
+# in the X-Admin-Token header
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+
+def token_matches(expected, header):
+    # Admin routes are disabled entirely while their token is unset
+    provided = request.headers.get(header)
+    if not expected or provided is None:
+        return False
+    return hmac.compare_digest(expected.encode(), provided.encode())
+
+
+def is_teacher():
+    # Browsers log in once at /teacher/login; scripts can send the header instead
+    return bool(ADMIN_TOKEN) and (session.get('teacher') is True or token_matches(ADMIN_TOKEN, 'X-Admin-Token'))
+
+
+# Opt-in sampling profiler. The /admin/profile route only exists in effect when
+# PROFILE_TOKEN is set, and requests must carry it in the X-Profile-Token header.
+# Only threads that are serving a request are sampled, so idle pool, logger and
+# server threads do not swamp the output.
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.005))
+PROFILE_MAX_SECONDS = 300
+
+
+class SamplingProfiler:
+    def __init__(self, interval=PROFILE_INTERVAL, output_dir=PROFILE_DIR):
+        self.interval = interval
+        self.output_dir = output_dir
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.stacks = Counter()
+        self.deadline = None
+        self.remaining_requests = 0
+        self.active = False
+        self.request_threads = set()
+        self.captures = 0
+        self.last_output = None
+
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, seconds=None, max_requests=None):
+        with self.lock:
+            if self.running():
+                return False
+            if seconds is None or not math.isfinite(seconds) or seconds <= 0:
+                seconds = PROFILE_MAX_SECONDS
+            seconds = min(seconds, PROFILE_MAX_SECONDS)
+            self.stacks = Counter()
+            self.deadline = time.monotonic() + seconds
+            self.remaining_requests = max(max_requests, 1) if max_requests is not None else 0
+            self.stop_event.clear()
+            self.active = True
+            self.thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self.thread.start()
+            return True
+
+    def stop(self):
+        thread = self.thread
+        if thread is None or not thread.is_alive():
+            return False
+        self.stop_event.set()
+        thread.join()
+        return True
+
+    def request_finished(self):
+        with self.lock:
+            if self.remaining_requests <= 0:
+                return
+            self.remaining_requests -= 1
+            if self.remaining_requests == 0:
+                self.stop_event.set()
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            if time.monotonic() >= self.deadline:
+                break
+            self._sample()
+        self.active = False
+        self.last_output = self._write()
+
+    def _sample(self):
+        request_threads = set(self.request_threads)
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id not in request_threads:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def _write(self):
+        # Collapsed-stack format, readable by flamegraph.pl and speedscope
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.captures += 1
+        name = f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self.captures}.collapsed"
+        path = os.path.join(self.output_dir, name)
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+profiler = SamplingProfiler()
+
+
+@app.before_request
+def track_profiled_request():
+    if profiler.active:
+        profiler.request_threads.add(threading.get_ident())
+
+
+@app.teardown_request
+def untrack_profiled_request(exception):
+    if profiler.request_threads:
+        profiler.request_threads.discard(threading.get_ident())
+
+
+@app.after_request
+def count_profiled_request(response):
+    if profiler.remaining_requests and request.endpoint != 'admin_profile':
+        profiler.request_finished()
+    return response
+
+
+@app.route('/admin/profile', methods=['GET', 'POST', 'DELETE'])
+def admin_profile():
+    if not token_matches(PROFILE_TOKEN, 'X-Profile-Token'):
+        return jsonify({'error': 'Not found'}), 404
+    if request.method == 'GET':
+        return jsonify({'running': profiler.running(), 'last_output': profiler.last_output})
+    if request.method == 'DELETE':
+        if not profiler.stop():
+            return jsonify({'error': 'No profile is being captured'}), 409
+        return jsonify({'running': False, 'last_output': profiler.last_output})
+
+    seconds = request.args.get('seconds', type=float)
+    requests_count = request.args.get('requests', type=int)
+    if 'seconds' in request.args and (seconds is None or not math.isfinite(seconds) or seconds <= 0):
+        return jsonify({'error': 'seconds must be a positive number'}), 400
+    if 'requests' in request.args and (requests_count is None or requests_count < 1):
+        return jsonify({'error': 'requests must be a positive integer'}), 400
+    if seconds is not None:
+        seconds = min(seconds, PROFILE_MAX_SECONDS)
+    if not profiler.start(seconds=seconds, max_requests=requests_count):
+        return jsonify({'error': 'A profile is already being captured'}), 409
+    return jsonify({'running': True, 'seconds': seconds, 'requests': requests_count}), 202
+
+
+# Structured event log. Handlers enqueue records and a background thread
+# batch-writes them as JSONL, so the request path never blocks on I/O.
+LOG_PATH = os.environ.get('LOG_PATH', os.path.join('logs', 'events.jsonl'))
+LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', 5 * 1024 * 1024))
+LOG_BACKUP_COUNT = 3
+LOG_QUEUE_SIZE = 10000
+LOG_BATCH_SIZE = 200
+
+
+class EventLogger:
+    def __init__(self, path=LOG_PATH, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT,
+                 queue_size=LOG_QUEUE_SIZE):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.dropped = 0
+        self.reported_drops = 0
+
+    def log(self, **record):
+        record['ts'] = time.time()
+        if self.thread is None:
+            self._start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+
+    def flush(self):
+        self.queue.join()
+
+    def _start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='event-logger', daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < LOG_BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except OSError:
+                with self.lock:
+                    self.dropped += len(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _write(self, batch):
+        with self.lock:
+            dropped = self.dropped
+        if dropped != self.reported_drops:
+            batch = batch + [{'event': 'log_dropped', 'count': dropped - self.reported_drops, 'ts': time.time()}]
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+            self._rotate()
+        with open(self.path, 'a') as f:
+            f.write(''.join(json.dumps(record, default=str) + '\n' for record in batch))
+        # Only count drops as reported once their record is on disk
+        self.reported_drops = dropped
+
+    def _rotate(self):
+        for i in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{i}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+
+event_log = EventLogger()
+
+
+def ensure_session_id():
+    # Cookie sessions have no ID of their own, so give each one a random ID
+    # and only ever log a digest of it. Only routes that already write the
+    # session call this; the drawing route must not send back a stale cookie.
+    if 'sid' not in session:
+        session['sid'] = uuid.uuid4().hex
+
+
+def session_hash():
+    sid = session.get('sid')
+    if sid is None:
+        return None
+    return hashlib.sha256(sid.encode()).hexdigest()[:12]
+
+
+def elapsed_ms(start):
+    return round((time.perf_counter() - start) * 1000, 1)
+
+
+# Archive of completed sessions so teachers can review a whole class afterwards.
+# Generated images are recorded as they are made, keyed by session hash, and
+# joined onto the session row at export time. The archive is off unless
+# ARCHIVE_PATH points at a writable file, and writes are best-effort: a failing
+# archive is logged but never breaks the child's session.
+ARCHIVE_PATH = os.environ.get('ARCHIVE_PATH')
+ARCHIVE_PAGE_SIZE = 20
+ARCHIVE_EXPORT_BATCH = 500
+ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_hash TEXT NOT NULL,
+    class_id TEXT,
+    device_id TEXT,
+    completed_at REAL NOT NULL,
+    responses TEXT NOT NULL,
+    questions TEXT NOT NULL,
+    final_advice TEXT
+);
+CREATE INDEX IF NOT EXISTS sessions_completed_at ON sessions (completed_at);
+CREATE INDEX IF NOT EXISTS sessions_class ON sessions (class_id, completed_at);
+CREATE INDEX IF NOT EXISTS sessions_device ON sessions (device_id, completed_at);
+CREATE TABLE IF NOT EXISTS session_images (
+    session_hash TEXT NOT NULL,
+    url TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS session_images_hash ON session_images (session_hash);
+CREATE TABLE IF NOT EXISTS approved_turns (
+    session_id INTEGER NOT NULL,
+    question_number INTEGER NOT NULL,
+    approved_at REAL NOT NULL,
+    PRIMARY KEY (session_id, question_number)
+);
+CREATE TABLE IF NOT EXISTS approved_questions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    question_number INTEGER NOT NULL,
+    question TEXT NOT NULL,
+    context TEXT NOT NULL,
+    approved_at REAL NOT NULL
+);
+"""
+ARCHIVE_COLUMNS = ['id', 'class_id', 'device_id', 'completed_at', 'responses', 'questions', 'final_advice', 'image_urls']
+ARCHIVE_SELECT = """
+SELECT s.id, s.class_id, s.device_id, s.completed_at, s.responses, s.questions, s.final_advice,
+       (SELECT json_group_array(i.url) FROM session_images i WHERE i.session_hash = s.session_hash) AS image_urls
+FROM sessions s
+"""
+archive_ready = False
+
+
+def connect_archive():
+    global archive_ready
+    if not ARCHIVE_PATH:
+        raise sqlite3.OperationalError('archive is disabled; set ARCHIVE_PATH')
+    conn = sqlite3.connect(ARCHIVE_PATH)
+    conn.row_factory = sqlite3.Row
+    if not archive_ready:
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(ARCHIVE_SCHEMA)
+        archive_ready = True
+    return conn
+
+
+def get_archive():
+    if 'archive' not in g:
+        g.archive = connect_archive()
+    return g.archive
+
+
+@app.teardown_appcontext
+def close_archive(exception):
+    conn = g.pop('archive', None)
+    if conn is not None:
+        conn.close()
+
+
+def log_archive_error(operation, error):
+    event_log.log(event='archive_error', operation=operation, error=str(error))
+
+
+def archive_image_urls(session_key, image_urls):
+    if not ARCHIVE_PATH:
+        return
+    now = time.time()
+    try:
+        conn = get_archive()
+        with conn:
+            conn.executemany(
+                'INSERT INTO session_images (session_hash, url, created_at) VALUES (?, ?, ?)',
+                [(session_key, url, now) for url in image_urls]
+            )
+    except sqlite3.Error as e:
+        log_archive_error('images', e)
+
+
+def archive_session(final_advice=None):
+    if not ARCHIVE_PATH:
+        return None
+    questions = [text for who, text in session.get('history', []) if who == 'Therapist']
+    try:
+        conn = get_archive()
+        with conn:
+            cursor = conn.execute(
+                'INSERT INTO sessions (session_hash, class_id, device_id, completed_at, responses, questions, final_advice) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (session_hash(), session.get('class_id'), session.get('device_id'), time.time(),
+                 json.dumps(session.get('responses', [])), json.dumps(questions), final_advice)
+            )
+        return cursor.lastrowid
+    except sqlite3.Error as e:
+        log_archive_error('session', e)
+        return None
+
+
+def archive_final_advice(session_id, final_advice):
+    # Called from background jobs, so it cannot use the request's connection
+    if session_id is None:
+        return
+    try:
+        conn = connect_archive()
+        try:
+            with conn:
+                conn.execute('UPDATE sessions SET final_advice = ? WHERE id = ?', (final_advice, session_id))
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        log_archive_error('final_advice', e)
+
+
+def archive_filters(class_id=None, before=None):
+    clauses, params = [], []
+    if class_id:
+        clauses.append('s.class_id = ?')
+        params.append(class_id)
+    if before:
+        clauses.append('s.id < ?')
+        params.append(before)
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ''
+    return where, params
+
+
+def archived_session(row):
+    record = dict(row)
+    for key in ('responses', 'questions', 'image_urls'):
+        record[key] = json.loads(record[key]) if record[key] else []
+    return record
+
+
+def list_archived_sessions(class_id=None, before=None, limit=ARCHIVE_PAGE_SIZE):
+    # Keyset pagination on id, so deep pages cost the same as the first one
+    where, params = archive_filters(class_id, before)
+    rows = get_archive().execute(f"{ARCHIVE_SELECT}{where} ORDER BY s.id DESC LIMIT ?", params + [limit])
+    return [archived_session(row) for row in rows]
+
+
+def iter_archived_sessions(class_id=None):
+    # Uses its own connection because it outlives the request context while
+    # streaming. The query runs before the first row is requested, so a broken
+    # archive fails here rather than halfway through the response.
+    where, params = archive_filters(class_id)
+    conn = connect_archive()
+    try:
+        cursor = conn.execute(f"{ARCHIVE_SELECT}{where} ORDER BY s.id", params)
+    except sqlite3.Error:
+        conn.close()
+        raise
+    return stream_archived_sessions(conn, cursor)
+
+
+def stream_archived_sessions(conn, cursor):
+    try:
+        while True:
+            rows = cursor.fetchmany(ARCHIVE_EXPORT_BATCH)
+            if not rows:
+                break
+            for row in rows:
+                yield archived_session(row)
+    finally:
+        conn.close()
+
+
 @app.route('/proxy')
 def proxy_image():
     image_url = request.args.get('url')
@@ -34,40 +490,138 @@ def proxy_image():
 
 @app.route('/api/process-drawing', methods=['POST'])
 def api_process_drawing():
+    timings = {}
+    record = {'event': 'request', 'route': request.path, 'session': session_hash(), 'timings': timings}
+    reappraisal_job = None
     try:
         data = request.get_json()
         drawing_data = data['drawing']
         text_description = data['description']
+        reappraisal_job = drawing_jobs.submit(generate_reappraisal_text, text_description)
 
         # Decode image from base64
+        start = time.perf_counter()
         image_data = base64.b64decode(drawing_data.split(',')[1])
         image = Image.open(BytesIO(image_data)).convert('RGBA')
+        timings['decode_ms'] = elapsed_ms(start)
 
         # Extract colors used in the drawing
-        raw_colors = {(r, g, b) for r, g, b, a in image.getdata() if a > 0}
-        raw_colors_hex = {f"#{r:02x}{g:02x}{b:02x}" for r, g, b in raw_colors}
-        used_colors_names = [BRUSH_COLORS[hex_color] for hex_color in raw_colors_hex if hex_color in BRUSH_COLORS]
+        start = time.perf_counter()
+        used_colors_names = extract_brush_colors(image)
+        timings['colors_ms'] = elapsed_ms(start)
 
-        # Generate prompt using colors and description
-        prompt = generate_prompt(text_description, used_colors_names)
-        print(f"Generated prompt for DALL-E: {prompt}")
+        # Describe where each color sits, unless it blows the CPU budget
+        start = time.perf_counter()
+        regions = describe_regions(image)
+        timings['regions_ms'] = elapsed_ms(start)
+        record['regions'] = regions is not None
+
+        # Generate prompt using colors, regions and description
+        prompt = generate_prompt(text_description, used_colors_names, regions)
+        record['prompt_length'] = len(prompt)
 
         # Generate image using the DALL-E API
+        start = time.perf_counter()
         image_urls = call_dalle_api(prompt, n=2)
+        timings['dalle_ms'] = elapsed_ms(start)
         if not image_urls:
             raise ValueError("Failed to generate images")
-
-        # Generate reappraisal advice text
-        reappraisal_text = generate_reappraisal_text(text_description)
-        print(f"Generated reappraisal text: {reappraisal_text}")
-
+        if record['session']:
+            archive_image_urls(record['session'], image_urls)
+
+        # Reappraisal advice has been generating since the description arrived
+        start = time.perf_counter()
+        try:
+            reappraisal_text = drawing_jobs.take(reappraisal_job, timeout=REAPPRAISAL_WAIT_SECONDS)
+        except FutureTimeoutError:
+            reappraisal_text = REAPPRAISAL_FALLBACK_TEXT
+            record['reappraisal_timeout'] = True
+        timings['reappraisal_wait_ms'] = elapsed_ms(start)
+        record['reappraisal_length'] = len(reappraisal_text)
+
+        event_log.log(status=200, **record)
         return jsonify({'image_urls': image_urls, 'reappraisal_text': reappraisal_text})
     except Exception as e:
-        print(f"Error processing drawing: {str(e)}")
+        if reappraisal_job:
+            drawing_jobs.cancel(reappraisal_job)
+        event_log.log(status=500, error=str(e), **record)
         return jsonify({'error': str(e)}), 500
 
 
-def generate_prompt(description, colors=None):
+# Region analysis runs on a downsampled grid so its cost does not grow with the
+# canvas, and is abandoned once it spends ANALYSIS_BUDGET_SECONDS of CPU time.
+# The budget uses the calling thread's CPU clock, so busy neighbouring threads
+# do not eat into it.
+ANALYSIS_GRID = 64
+ANALYSIS_MIN_CELLS = 2
+ANALYSIS_MAX_COLORS = 5
+ANALYSIS_BUDGET_SECONDS = float(os.environ.get('ANALYSIS_BUDGET_SECONDS', 0.05))
+
+
+def extract_brush_colors(image):
+    colors = image.getcolors(maxcolors=image.width * image.height) or []
+    raw_colors_hex = {f"#{r:02x}{g:02x}{b:02x}" for count, (r, g, b, a) in colors if a > 0}
+    return [BRUSH_COLORS[hex_color] for hex_color in raw_colors_hex if hex_color in BRUSH_COLORS]
+
+
+def region_position(x, y, width, height):
+    vertical = ('top', 'middle', 'bottom')[min(int(3 * y / height), 2)]
+    horizontal = ('left', 'center', 'right')[min(int(3 * x / width), 2)]
+    if vertical == 'middle':
+        return 'center' if horizontal == 'center' else f"middle {horizontal}"
+    return f"{vertical} {horizontal}"
+
+
+def region_size(cells, total):
+    share = cells / total
+    if share > 0.25:
+        return 'large'
+    if share > 0.05:
+        return 'medium'
+    return 'small'
+
+
+def describe_regions(image, budget=ANALYSIS_BUDGET_SECONDS):
+    deadline = time.thread_time() + budget
+    scale = min(1.0, ANALYSIS_GRID / max(image.size))
+    width, height = max(1, round(image.width * scale)), max(1, round(image.height * scale))
+    small = image.resize((width, height), Image.NEAREST)
+    cells = [BRUSH_COLORS.get(f"#{r:02x}{g:02x}{b:02x}") if a > 0 else None for r, g, b, a in small.getdata()]
+
+    # Label 8-connected regions of the same brush color
+    blobs = defaultdict(list)
+    seen = [False] * len(cells)
+    for cell, color in enumerate(cells):
+        if color is None or seen[cell]:
+            continue
+        if time.thread_time() > deadline:
+            return None
+        seen[cell] = True
+        stack, size, sum_x, sum_y = [cell], 0, 0, 0
+        while stack:
+            current = stack.pop()
+            y, x = divmod(current, width)
+            size, sum_x, sum_y = size + 1, sum_x + x, sum_y + y
+            for row in range(max(y - 1, 0) * width, min(y + 2, height) * width, width):
+                for neighbour in range(row + max(x - 1, 0), row + min(x + 2, width)):
+                    if not seen[neighbour] and cells[neighbour] == color:
+                        seen[neighbour] = True
+                        stack.append(neighbour)
+        if size >= ANALYSIS_MIN_CELLS:
+            blobs[color].append((size, (sum_x + size / 2) / size, (sum_y + size / 2) / size))
+
+    parts = []
+    ranked = sorted(blobs.items(), key=lambda item: -sum(size for size, _, _ in item[1]))
+    for color, regions in ranked[:ANALYSIS_MAX_COLORS]:
+        size, x, y = max(regions)
+        part = f"a {region_size(size, width * height)} {color} shape at the {region_position(x, y, width, height)}"
+        if len(regions) > 1:
+            part += f" with {len(regions) - 1} more {color} shape{'s' if len(regions) > 2 else ''}"
+        parts.append(part)
+    return '; '.join(parts) or None
+
+
+def generate_prompt(description, colors=None, regions=None):
     if colors:
         color_description = ', '.join(colors)
         prompt = (
@@ -76,6 +630,8 @@ def generate_prompt(description, colors=None):
             f"into a fantastic scene with a rainbow or stars or sunshines. The image must focus entirely on visual elements without any text, "
             f"letters, or numbers."
         )
+        if regions:
+            prompt += f" The child's drawing has {regions}; keep a similar composition."
     else:
         prompt = (
             f"Create a purely visual artistic oil painting drawing that reimagines '{description}' in a positive manner. "
@@ -84,7 +640,13 @@ def generate_prompt(description, colors=None):
         )
     return prompt
 
+
+REAPPRAISAL_UPSTREAM_TIMEOUT = 20
+REAPPRAISAL_FALLBACK_TEXT = "Could not generate reappraisal text."
+
+
 def generate_reappraisal_text(description):
+    start = time.perf_counter()
     try:
         response = openai.Completion.create(
             engine="gpt-3.5-turbo-instruct",
@@ -94,15 +656,18 @@ def generate_reappraisal_text(description):
                 f"beginning with a new, complete sentence that helps the child view the emotion in a brighter, hopeful way. "
                 f"Keep the language simple and friendly, and focus on encouragement and optimism."
             ),
-            max_tokens=100
+            max_tokens=100,
+            request_timeout=REAPPRAISAL_UPSTREAM_TIMEOUT
         )
         if 'choices' in response and len(response.choices) > 0:
+            event_log.log(event='upstream', service='completion', status='ok', ms=elapsed_ms(start))
             return response.choices[0].text.strip()
         else:
+            event_log.log(event='upstream', service='completion', status='empty', ms=elapsed_ms(start))
             return "Could not generate a response. Please try again."
     except Exception as e:
-        print(f"Error generating reappraisal text: {str(e)}")
-        return "Could not generate reappraisal text."
+        event_log.log(event='upstream', service='completion', status='error', error=str(e), ms=elapsed_ms(start))
+        return REAPPRAISAL_FALLBACK_TEXT
 
 
 def call_dalle_api(prompt, n=2):
@@ -110,6 +675,7 @@ def call_dalle_api(prompt, n=2):
     headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
     payload = {"prompt": prompt, "n": n, "size": "512x512"}
 
+    start = time.perf_counter()
     try:
         response = requests.post(
             "https://api.openai.com/v1/images/generations",
@@ -118,11 +684,12 @@ def call_dalle_api(prompt, n=2):
         )
         response.raise_for_status()
         images = response.json().get('data', [])
-        if not images:
-            print("No images returned from DALL-E.")
+        event_log.log(event='upstream', service='dalle', status=response.status_code,
+                      images=len(images), ms=elapsed_ms(start))
         return [image['url'] for image in images]
     except requests.exceptions.RequestException as e:
-        print(f"Error from OpenAI API: {e}")
+        status = e.response.status_code if e.response is not None else None
+        event_log.log(event='upstream', service='dalle', status=status, error=str(e), ms=elapsed_ms(start))
         return []
 
 
@@ -133,6 +700,254 @@ predefined_sentences = {
 }
 
 
+# Local fallback for therapist questions. Approved questions are indexed per
+# question number by TF-IDF terms of the responses that led to them; when the
+# upstream completion misses QUESTION_BUDGET_SECONDS, the closest match is served.
+QUESTION_BUDGET_SECONDS = float(os.environ.get('QUESTION_BUDGET_SECONDS', 4.0))
+QUESTION_UPSTREAM_TIMEOUT = 30
+STOP_WORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'do', 'for', 'i', 'in', 'is', 'it', "it's",
+    'me', 'my', 'of', 'on', 'or', 'so', 'that', 'the', 'this', 'to', 'was', 'when', 'with', 'you'
+}
+
+QUESTION_POOL_SIZE = 32
+# Question 6 is a summary of the child's own answers plus advice, so it is
+# never a reusable question and is neither banked nor served from the bank
+BANKABLE_QUESTIONS = range(1, 6)
+
+# Completions that miss the budget keep running until QUESTION_UPSTREAM_TIMEOUT,
+# so they get their own pool rather than starving other background work.
+question_pool = ThreadPoolExecutor(max_workers=QUESTION_POOL_SIZE, thread_name_prefix='question')
+
+
+def tokenize(text):
+    return [word for word in re.findall(r"[a-z']+", text.lower()) if word not in STOP_WORDS]
+
+
+class QuestionBank:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.questions = defaultdict(list)
+        self.postings = defaultdict(lambda: defaultdict(list))
+        self.norms = defaultdict(list)
+        self.stats = Counter()
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def snapshot_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def add(self, question_number, question, context):
+        with self.lock:
+            self._add(question_number, question, context)
+
+    def _add(self, question_number, question, context):
+        # Incremental: a new question only touches its own postings
+        doc_id = len(self.questions[question_number])
+        counts = Counter(tokenize(context))
+        self.questions[question_number].append(question)
+        self.norms[question_number].append(math.sqrt(sum(c * c for c in counts.values())) or 1.0)
+        for term, count in counts.items():
+            self.postings[question_number][term].append((doc_id, count))
+
+    def load(self):
+        with self.lock:
+            if self.loaded:
+                return
+            self.loaded = True
+            if not ARCHIVE_PATH:
+                return
+            try:
+                conn = connect_archive()
+                try:
+                    rows = conn.execute('SELECT question_number, question, context FROM approved_questions ORDER BY id')
+                    for row in rows:
+                        if row['question_number'] not in BANKABLE_QUESTIONS:
+                            continue
+                        self._add(row['question_number'], row['question'], row['context'])
+                finally:
+                    conn.close()
+            except sqlite3.Error as e:
+                log_archive_error('load_questions', e)
+
+    def snapshot_sizes(self):
+        with self.lock:
+            return {number: len(items) for number, items in self.questions.items()}
+
+    def match(self, question_number, responses_text):
+        if question_number not in BANKABLE_QUESTIONS:
+            return None
+        self.load()
+        with self.lock:
+            questions = self.questions.get(question_number)
+            if not questions:
+                return None
+            postings = self.postings[question_number]
+            norms = self.norms[question_number]
+            scores = Counter()
+            for term, query_count in Counter(tokenize(responses_text)).items():
+                docs = postings.get(term)
+                if not docs:
+                    continue
+                idf = math.log((1 + len(questions)) / (1 + len(docs))) + 1
+                for doc_id, count in docs:
+                    scores[doc_id] += query_count * count * idf * idf
+            # Ties, including no overlap at all, go to the most recently approved question
+            best = max(range(len(questions)), key=lambda doc_id: (scores[doc_id] / norms[doc_id], doc_id))
+            return questions[best]
+
+
+question_bank = QuestionBank()
+
+
+def request_question_completion(prompt_text):
+    response = openai.Completion.create(
+        engine="gpt-3.5-turbo-instruct",
+        prompt=prompt_text,
+        max_tokens=150,
+        n=1,
+        temperature=0.7,
+        request_timeout=QUESTION_UPSTREAM_TIMEOUT
+    )
+    return response.choices[0].text.strip()
+
+
+def logged_question_completion(prompt_text):
+    # Logs the call's own latency, which can outlast the request after a fallback
+    start = time.perf_counter()
+    try:
+        question_text = request_question_completion(prompt_text)
+    except Exception as e:
+        event_log.log(event='upstream', service='completion', status='error', error=str(e), ms=elapsed_ms(start))
+        raise
+    event_log.log(event='upstream', service='completion', status='ok', ms=elapsed_ms(start))
+    return question_text
+
+
+def fetch_question_text(prompt_text, question_number, responses_text):
+    start = time.perf_counter()
+    future = question_pool.submit(logged_question_completion, prompt_text)
+    try:
+        question_text = future.result(timeout=QUESTION_BUDGET_SECONDS)
+        question_bank.count('upstream')
+        return question_text
+    except Exception as e:
+        reason = 'timeout' if isinstance(e, FutureTimeoutError) else 'error'
+        fallback = question_bank.match(question_number, responses_text)
+        if fallback is None:
+            # Nothing approved for this question yet, so wait out the upstream
+            # call, but no longer than its own timeout
+            question_bank.count(f'{reason}_unserved')
+            return future.result(timeout=max(QUESTION_UPSTREAM_TIMEOUT - (time.perf_counter() - start), 0))
+        question_bank.count(f'fallback_{reason}')
+        event_log.log(event='question_fallback', reason=reason, question_number=question_number,
+                      ms=elapsed_ms(start))
+        return fallback
+
+
+def strip_question_prefix(question_number, text):
+    text = re.sub(r'^Question \d+:\s*', '', text)
+    predefined = predefined_sentences.get(question_number)
+    if predefined and text.startswith(predefined):
+        text = text[len(predefined):]
+    return text.strip()
+
+
+def approve_session_questions(session_id, selections):
+    # The teacher picks individual questions from an archived session and may
+    # rewrite them so no child's own words end up in the bank. Question N was
+    # asked after the first N-1 responses, which become its context.
+    # Approving the same question twice raises sqlite3.IntegrityError.
+    conn = get_archive()
+    row = conn.execute('SELECT responses, questions FROM sessions WHERE id = ?', (session_id,)).fetchone()
+    if row is None:
+        return None
+    responses = json.loads(row['responses'])
+    asked = {}
+    for text in json.loads(row['questions']):
+        match = re.match(r'Question (\d+):', text)
+        if match:
+            question_number = int(match.group(1))
+            asked[question_number] = strip_question_prefix(question_number, text)
+
+    approved = []
+    for question_number, text in selections:
+        if question_number not in BANKABLE_QUESTIONS:
+            raise ValueError(f"Question {question_number} cannot be banked")
+        if question_number not in asked:
+            raise ValueError(f"Question {question_number} was not asked in session {session_id}")
+        approved.append((question_number, text or asked[question_number],
+                         ' '.join(responses[:question_number - 1])))
+    question_bank.load()
+    now = time.time()
+    with conn:
+        conn.executemany(
+            'INSERT INTO approved_turns (session_id, question_number, approved_at) VALUES (?, ?, ?)',
+            [(session_id, number, now) for number, question, context in approved]
+        )
+        conn.executemany(
+            'INSERT INTO approved_questions (question_number, question, context, approved_at) VALUES (?, ?, ?, ?)',
+            [(number, question, context, now) for number, question, context in approved]
+        )
+    for number, question, context in approved:
+        question_bank.add(number, question, context)
+    return len(approved)
+
+
+def is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def parse_question_selections(data):
+    if not isinstance(data, dict) or not is_int(data.get('session_id')):
+        return None
+    items = data.get('questions')
+    if not isinstance(items, list) or not items:
+        return None
+    selections = []
+    for item in items:
+        if not isinstance(item, dict) or not is_int(item.get('question_number')):
+            return None
+        text = item.get('text')
+        if text is not None and not (isinstance(text, str) and text.strip()):
+            return None
+        selections.append((item['question_number'], text.strip() if text else None))
+    return selections
+
+
+@app.route('/admin/questions', methods=['GET', 'POST'])
+def admin_questions():
+    if not token_matches(ADMIN_TOKEN, 'X-Admin-Token'):
+        return jsonify({'error': 'Not found'}), 404
+    if request.method == 'GET':
+        question_bank.load()
+        return jsonify({
+            'stats': question_bank.snapshot_stats(),
+            'questions': question_bank.snapshot_sizes()
+        })
+
+    # Body: {"session_id": 12, "questions": [{"question_number": 2, "text": "optional rewrite"}]}
+    data = request.get_json(silent=True)
+    selections = parse_question_selections(data)
+    if selections is None:
+        return jsonify({'error': 'Expected {"session_id": int, "questions": [{"question_number": int, "text": str}]}'}), 400
+    try:
+        approved = approve_session_questions(data['session_id'], selections)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except sqlite3.IntegrityError:
+        return jsonify({'error': 'Question already approved'}), 409
+    except sqlite3.Error as e:
+        return jsonify({'error': f"Archive unavailable: {e}"}), 503
+    if approved is None:
+        return jsonify({'error': 'Unknown session'}), 404
+    return jsonify({'approved': approved})
+
+
 def generate_art_therapy_question(api_key, question_number, session_history):
     openai.api_key = api_key
     question_prompts = [
@@ -149,14 +964,7 @@ def generate_art_therapy_question(api_key, question_number, session_history):
 
     if 1 <= question_number <= 6:
         prompt_text = f"{context} {question_prompts[question_number - 1]}"
-        response = openai.Completion.create(
-            engine="gpt-3.5-turbo-instruct",
-            prompt=prompt_text,
-            max_tokens=150,
-            n=1,
-            temperature=0.7
-        )
-        question_text = response.choices[0].text.strip()
+        question_text = fetch_question_text(prompt_text, question_number, user_responses)
 
         if question_number in predefined_sentences:
             full_question_text = f"Question {question_number}: {predefined_sentences[question_number]} {question_text}"
@@ -170,8 +978,136 @@ def generate_art_therapy_question(api_key, question_number, session_history):
 
 
 
+# Speculative background work. Jobs run on a worker pool as soon as their
+# inputs are known; callers either wait on the token or hand it to the client,
+# which polls /api/precompute/<token>. Cancelling only stops a job that has not
+# started yet; forgetting stops delivery and lets a running job finish.
+# Jobs live in this process only. With several workers, or on serverless hosts
+# that freeze threads between requests, a poll can miss its job, so the
+# end-of-session summary keeps enough in the cookie to be rebuilt on demand.
+# Drawing text and end-of-session summaries get separate pools sized for a
+# whole class finishing at once, so neither queues behind the other.
+PRECOMPUTE_TTL_SECONDS = 600
+PRECOMPUTE_MAX_WAIT_SECONDS = 10
+PRECOMPUTE_POOL_SIZE = 32
+REAPPRAISAL_WAIT_SECONDS = REAPPRAISAL_UPSTREAM_TIMEOUT + 5
+
+
+class Precomputer:
+    def __init__(self, pool):
+        self.pool = pool
+        self.lock = threading.Lock()
+        self.jobs = {}
+
+    def submit(self, fn, *args):
+        token = uuid.uuid4().hex
+        future = self.pool.submit(fn, *args)
+        with self.lock:
+            self._expire()
+            self.jobs[token] = (future, time.monotonic())
+        return token
+
+    def result(self, token, timeout=None):
+        with self.lock:
+            job = self.jobs.get(token)
+        if job is None:
+            raise KeyError(token)
+        return job[0].result(timeout=timeout)
+
+    def take(self, token, timeout=None):
+        try:
+            return self.result(token, timeout)
+        finally:
+            with self.lock:
+                self.jobs.pop(token, None)
+
+    def cancel(self, token):
+        with self.lock:
+            job = self.jobs.pop(token, None)
+        if job is not None:
+            job[0].cancel()
+
+    def forget(self, token):
+        # Stops delivery only; the job still runs to completion
+        with self.lock:
+            self.jobs.pop(token, None)
+
+    def _expire(self):
+        cutoff = time.monotonic() - PRECOMPUTE_TTL_SECONDS
+        for token in [token for token, job in self.jobs.items() if job[1] < cutoff]:
+            del self.jobs[token]
+
+
+drawing_jobs = Precomputer(ThreadPoolExecutor(max_workers=PRECOMPUTE_POOL_SIZE, thread_name_prefix='drawing'))
+summary_jobs = Precomputer(ThreadPoolExecutor(max_workers=PRECOMPUTE_POOL_SIZE, thread_name_prefix='summary'))
+
+
+def finish_session(archive_id, last_response, all_responses):
+    # The archive wants the advice even if the child has moved on
+    start = time.perf_counter()
+    final_advice = generate_reappraisal_text(last_response)
+    archive_final_advice(archive_id, final_advice)
+    event_log.log(event='precompute', job='final_advice', ms=elapsed_ms(start))
+    return all_responses + f"\nFinal Advice: {final_advice}"
+
+
+def read_final_advice(archive_id):
+    if archive_id is None:
+        return None
+    try:
+        row = get_archive().execute('SELECT final_advice FROM sessions WHERE id = ?', (archive_id,)).fetchone()
+    except sqlite3.Error as e:
+        log_archive_error('read_final_advice', e)
+        return None
+    return row['final_advice'] if row else None
+
+
+def recover_summary(token):
+    # The job is unknown to this process, so rebuild the summary from the
+    # cookie: reuse the archived advice if another worker finished it,
+    # otherwise generate it here.
+    pending = session.get('pending_summary')
+    if not pending or pending.get('token') != token:
+        return None
+    final_advice = read_final_advice(pending['archive_id'])
+    if final_advice is None:
+        final_advice = generate_reappraisal_text(pending['last_response'])
+        archive_final_advice(pending['archive_id'], final_advice)
+    return pending['all_responses'] + f"\nFinal Advice: {final_advice}"
+
+
+def cancel_pending_summary():
+    # A child who starts over no longer needs the previous session's advice
+    # delivered, but an archived session still gets it written
+    pending = session.pop('pending_summary', None)
+    if not pending:
+        return
+    if pending.get('archive_id') is None:
+        summary_jobs.cancel(pending['token'])
+    else:
+        summary_jobs.forget(pending['token'])
+
+
+@app.route('/api/precompute/<token>', methods=['GET'])
+def api_precompute(token):
+    wait = min(request.args.get('wait', 0, type=float), PRECOMPUTE_MAX_WAIT_SECONDS)
+    try:
+        result = summary_jobs.result(token, timeout=wait)
+    except KeyError:
+        result = recover_summary(token)
+        if result is None:
+            return jsonify({'error': 'Unknown or cancelled job'}), 404
+    except FutureTimeoutError:
+        return jsonify({'ready': False}), 202
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    return jsonify({'ready': True, 'result': result})
+
+
 @app.route('/api/question', methods=['POST'])
 def api_question():
+    cancel_pending_summary()
+    ensure_session_id()
     data = request.json
     user_response = data.get('response', '')
     session['history'] = session.get('history', [])
@@ -183,9 +1119,12 @@ def api_question():
     session['responses'].append(user_response)
 
     if session['question_number'] <= 6:
+        start = time.perf_counter()
         question_text = generate_art_therapy_question(
             app.secret_key, session['question_number'], session['history']
         )
+        event_log.log(event='request', route=request.path, session=session_hash(), status=200,
+                      question_number=session['question_number'], timings={'question_ms': elapsed_ms(start)})
         session['history'].append(('Therapist', question_text))
         session['question_number'] += 1
         progress = (session['question_number'] - 1) / 6 * 100
@@ -196,20 +1135,43 @@ def api_question():
             'restart': False
         })
     else:
-        # Send all responses back when it's the last question
+        # Send all responses back when it's the last question. The final advice
+        # is computed in the background and fetched from /api/precompute.
         all_responses = "\n".join([f"Response {i+1}: {response}" for i, response in enumerate(session['responses'])])
-        final_advice = generate_reappraisal_text(session['responses'][-1])
+        start = time.perf_counter()
+        archive_id = archive_session()
+        last_response = session['responses'][-1]
+        summary_job = summary_jobs.submit(finish_session, archive_id, last_response, all_responses)
+        event_log.log(event='request', route=request.path, session=session_hash(), status=200,
+                      question_number=session['question_number'], timings={'archive_ms': elapsed_ms(start)})
+        kept = {key: session[key] for key in ('class_id', 'device_id', 'teacher') if key in session}
         session.clear()
+        session.update(kept)
+        # Kept in the cookie so any worker can rebuild the summary; the poll
+        # route only reads it, so it never sends back a stale cookie
+        session['pending_summary'] = {
+            'token': summary_job,
+            'archive_id': archive_id,
+            'last_response': last_response,
+            'all_responses': all_responses
+        }
         return jsonify({
             'question': 'Let\'s restart!',
             'progress': 100,
-            'responses': all_responses + f"\nFinal Advice: {final_advice}",
+            'responses': all_responses + "\nFinal Advice: ...",
+            'summary': summary_job,
             'restart': True
         })
         
 
 @app.route('/', methods=['GET'])
 def home():
+    cancel_pending_summary()
+    # Tablets in a classroom are opened with /?class=<id>&device=<id>
+    for key, arg in (('class_id', 'class'), ('device_id', 'device')):
+        if request.args.get(arg):
+            session[key] = request.args[arg]
+    ensure_session_id()
     session['history'] = session.get('history', [])
     session['question_number'] = session.get('question_number', 1)
     initial_question = generate_art_therapy_question(
@@ -409,6 +1371,9 @@ def home():
                             // Show the reflection area when the last question is reached
                             //document.getElementById('reflectionContainer').style.display = 'block';
                             document.getElementById('reflectionContainer').innerHTML = `<div class="responses">${data.responses}</div>`;
+                            if (data.summary) {
+                                pollSummary(data.summary);
+                            }
                         }
                     })
                     .catch(error => console.error('Error:', error));
@@ -416,6 +1381,21 @@ def home():
                 }
 
 
+                function pollSummary(token) {
+                    // The final advice is prepared in the background; long-poll until it is ready
+                    fetch('/api/precompute/' + token + '?wait=10')
+                    .then(res => res.json().then(data => ({status: res.status, data: data})))
+                    .then(({status, data}) => {
+                        if (status === 202) {
+                            pollSummary(token);
+                        } else if (data.ready && data.result) {
+                            document.getElementById('reflectionContainer').innerHTML = `<div class="responses">${data.result}</div>`;
+                        }
+                    })
+                    .catch(error => console.error('Error:', error));
+                }
+
+
                 function viewReflection() {
                     document.getElementById('reflectionContainer').scrollIntoView({ behavior: 'smooth' });
                 }
@@ -738,10 +1718,69 @@ def home():
     </html>
     """, latest_question=latest_question, progress_value=progress_value)
 
+@app.route('/teacher/login', methods=['GET', 'POST'])
+def teacher_login():
+    if not ADMIN_TOKEN:
+        return jsonify({'error': 'Not found'}), 404
+    error = None
+    if request.method == 'POST':
+        provided = request.form.get('token', '')
+        if hmac.compare_digest(ADMIN_TOKEN.encode(), provided.encode()):
+            session['teacher'] = True
+            return redirect('/reflection')
+        error = 'That token is not right.'
+    return render_template_string("""
+    <html>
+        <head>
+            <title>Teacher Login</title>
+            <style>
+                body {
+                    font-family: 'Helvetica', sans-serif;
+                    padding: 20px;
+                    background-color: #f0f8ff;
+                }
+                .button-style {
+                    color: white;
+                    background-color: black;
+                    padding: 5px 10px;
+                    cursor: pointer;
+                    border: none;
+                    margin-left: 10px;
+                    border-radius: 4px;
+                }
+            </style>
+        </head>
+        <body>
+            <h1>Teacher login</h1>
+            {% if error %}<p>{{ error }}</p>{% endif %}
+            <form method="post">
+                <input type="password" name="token" placeholder="Teacher token">
+                <button class="button-style" type="submit">Log in</button>
+            </form>
+        </body>
+    </html>
+    """, error=error), 401 if error else 200
+
+
+@app.route('/teacher/logout', methods=['POST'])
+def teacher_logout():
+    session.pop('teacher', None)
+    return redirect('/reflection')
+
+
 @app.route('/reflection', methods=['GET'])
 def reflection():
     responses = session.get('responses', [])
     formatted_responses = "<br>".join([f"Response {i + 1}: {response}" for i, response in enumerate(responses)])
+    # Archived sessions of other children are only shown to teachers
+    class_id, archived = None, []
+    if ARCHIVE_PATH and is_teacher():
+        class_id = request.args.get('class') or session.get('class_id')
+        try:
+            archived = list_archived_sessions(class_id, request.args.get('before', type=int))
+        except sqlite3.Error as e:
+            log_archive_error('list', e)
+    older = archived[-1]['id'] if len(archived) == ARCHIVE_PAGE_SIZE else None
     return render_template_string("""
     <html>
         <head>
@@ -778,9 +1817,62 @@ def reflection():
             <h1>Here is what your kids thought about today.</h1>
             <div class="responses">{{ responses|safe }}</div>
             <button class="button-style" style="margin-top: 20px;" onclick="window.location.href='/'">Restart Session</button>
+            {% if archived %}
+            <h2>Completed sessions{% if class_id %} for {{ class_id }}{% endif %}</h2>
+            {% for item in archived %}
+            <div class="responses">
+                <strong>{{ item.completed_at|datetime }}</strong>{% if item.device_id %} &middot; {{ item.device_id }}{% endif %}<br>
+                {% for response in item.responses %}Response {{ loop.index }}: {{ response }}<br>{% endfor %}
+                {% if item.final_advice %}Final Advice: {{ item.final_advice }}<br>{% endif %}
+                {% for url in item.image_urls %}<a href="{{ url }}">Image {{ loop.index }}</a> {% endfor %}
+            </div>
+            {% endfor %}
+            {% if older %}
+            <a href="?before={{ older }}{% if class_id %}&class={{ class_id|urlencode }}{% endif %}">Older sessions</a>
+            {% endif %}
+            <a href="/reflection/export?format=csv{% if class_id %}&class={{ class_id|urlencode }}{% endif %}">Download CSV</a>
+            {% endif %}
+            {% if teacher %}
+            <form method="post" action="/teacher/logout"><button class="button-style" type="submit">Log out</button></form>
+            {% endif %}
         </body>
     </html>
-    """, responses=formatted_responses)
+    """, responses=formatted_responses, archived=archived, older=older, class_id=class_id, teacher=session.get('teacher'))
+
+
+@app.template_filter('datetime')
+def format_timestamp(value):
+    return time.strftime('%Y-%m-%d %H:%M', time.localtime(value))
+
+
+@app.route('/reflection/export', methods=['GET'])
+def reflection_export():
+    if not is_teacher():
+        return jsonify({'error': 'Not found'}), 404
+    class_id = request.args.get('class')
+    try:
+        sessions = iter_archived_sessions(class_id)
+    except sqlite3.Error as e:
+        return jsonify({'error': f"Archive unavailable: {e}"}), 503
+
+    if request.args.get('format') == 'jsonl':
+        lines = (json.dumps(item) + '\n' for item in sessions)
+        return Response(lines, mimetype='application/x-ndjson',
+                        headers={'Content-Disposition': 'attachment; filename=reflections.jsonl'})
+
+    def csv_rows():
+        buffer = StringIO()
+        writer = csv.writer(buffer)
+        rows = ([json.dumps(item[column]) if isinstance(item[column], list) else item[column]
+                 for column in ARCHIVE_COLUMNS] for item in sessions)
+        for row in itertools.chain([ARCHIVE_COLUMNS], rows):
+            writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    return Response(csv_rows(), mimetype='text/csv',
+                    headers={'Content-Disposition': 'attachment; filename=reflections.csv'})
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=int(os.environ.get("PORT", 5000)))